@@ -0,0 +1,836 @@
+import json
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import zlib
+import tempfile
+import functools
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+from urllib.parse import urlparse
+from typing import Optional
+import logging
+
+# Configuration
+API_KEY = os.environ.get('API_KEY', 'secret-api-key')
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+MODEL_NAME = 'gemini-2.5-flash'
+# Gemini 2.5 thinking tokens count toward this cap, so leave room beyond the answer
+MAX_OUTPUT_TOKENS = int(os.environ.get('MAX_OUTPUT_TOKENS', 8192))
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', 60))
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', 4_000_000))
+CACHE_PATH = os.environ.get('CACHE_PATH', '/tmp/demo_agent_cache.db')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1000))
+SKIP_CACHE_COMMAND = '!skip'
+MAX_ITERATIONS_MESSAGE = "Max iterations reached"
+PDF_CACHE_TTL = int(os.environ.get('PDF_CACHE_TTL', 86400))
+PDF_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CACHE_MAX_ENTRIES', 256))
+SCRAPER_POOL_SIZE = 10
+SCRAPER_CACHE_SIZE = 32
+INLINE_TEXT_LIMIT = int(os.environ.get('INLINE_TEXT_LIMIT', 20000))
+PREVIEW_CHARS = 2000
+MAX_CHUNK_CHARS = 20000
+DOCUMENT_STORE_SIZE = 32
+# Without REDIS_URL, stored clearance is local to one container and lost on cold starts
+REDIS_URL = os.environ.get('REDIS_URL')
+CLEARANCE_TTL = int(os.environ.get('CLEARANCE_TTL', 1800))
+CHALLENGE_STATUSES = (403, 503)
+PDF_CHUNK_SIZE = 1 << 20
+MAX_TOOL_WORKERS = 8
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE', '').lower() in ('1', 'true', 'yes')
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.90))
+SEMANTIC_CACHE_MODEL = os.environ.get('SEMANTIC_CACHE_MODEL', 'all-MiniLM-L6-v2')
+
+# Logging: no-op basicConfig under Lambda, which installs its own root handler
+logging.basicConfig()
+log = logging.getLogger(__name__)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+log.setLevel(LOG_LEVEL)
+
+if not GEMINI_API_KEY:
+    log.warning("GEMINI_API_KEY not set!")
+else:
+    log.info("GEMINI_API_KEY is set")
+
+if 'API_KEY' not in os.environ:
+    log.warning("API_KEY not set, using the default key")
+
+# Authentication
+def check_api_key(auth_header: Optional[str]) -> Optional[tuple]:
+    """Validate an Authorization header against API_KEY.
+
+    Returns None when the key is valid, otherwise a ``(status_code, payload)`` error.
+    """
+    if not auth_header:
+        return 401, {
+            "error": "Missing API key",
+            "message": "Please provide an API key in the Authorization header"
+        }
+    
+    if auth_header.startswith('Bearer '):
+        provided_key = auth_header[7:]
+    else:
+        provided_key = auth_header
+    
+    if provided_key != API_KEY:
+        return 403, {
+            "error": "Invalid API key",
+            "message": "The provided API key is not valid"
+        }
+    return None
+
+# Heavy SDKs are imported on first use to keep cold starts cheap
+_genai = None
+
+def _get_genai():
+    """Import and configure google.generativeai once per process."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        if GEMINI_API_KEY:
+            genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+# Response Cache
+class Cache:
+    """SQLite-backed key/value cache with TTL expiry and LRU eviction."""
+
+    def __init__(self, path: str, table: str = "cache", ttl: int = 3600, max_entries: int = 1000,
+                 compress: bool = False):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB, created_at REAL, last_access REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        if self.compress:
+            value = zlib.decompress(value).decode()
+        return value
+
+    def set(self, key: str, value):
+        now = time.time()
+        if self.compress:
+            value = zlib.compress(value.encode())
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            # Evict least recently used entries beyond max_entries
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key NOT IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+class RedisCache:
+    """Redis-backed key/value cache with TTL expiry, shared across containers.
+
+    Requires the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "cache", ttl: int = 3600):
+        import redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=2)
+
+    def get(self, key: str):
+        return self._client.get(f"{self.prefix}:{key}")
+
+    def set(self, key: str, value: str):
+        self._client.set(f"{self.prefix}:{key}", value, ex=self.ttl)
+
+def cache_key(**fields) -> str:
+    """Build a deterministic SHA-256 cache key from keyword fields."""
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+response_cache = Cache(CACHE_PATH, table="responses", ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+pdf_cache = Cache(CACHE_PATH, table="pdf_text", ttl=PDF_CACHE_TTL, max_entries=PDF_CACHE_MAX_ENTRIES,
+                  compress=True)
+clearance_cache = None
+if REDIS_URL:
+    try:
+        clearance_cache = RedisCache(REDIS_URL, prefix="cf_clearance", ttl=CLEARANCE_TTL)
+    except Exception as e:
+        log.warning("Shared clearance store unavailable, using the local cache: %s", e)
+if clearance_cache is None:
+    clearance_cache = Cache(CACHE_PATH, table="cf_clearance", ttl=CLEARANCE_TTL)
+
+# Rate Limiting
+class RateLimiter:
+    """Thread-safe sliding-window limiter on requests and tokens per period.
+
+    A limit of 0 (or less) disables that budget.
+    """
+
+    def __init__(self, max_requests: int, max_tokens: int, period: float = 60.0):
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.period = period
+        self._lock = threading.Lock()
+        self._requests = collections.deque()
+        self._tokens = collections.deque()
+        self._token_total = 0
+
+    def _prune(self, now: float):
+        while self._requests and now - self._requests[0] >= self.period:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= self.period:
+            self._token_total -= self._tokens.popleft()[1]
+
+    def acquire(self):
+        """Block until one more request fits within both budgets."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                waits = []
+                if self.max_requests > 0 and len(self._requests) >= self.max_requests:
+                    waits.append(self._requests[0] + self.period - now)
+                if self.max_tokens > 0 and self._token_total >= self.max_tokens:
+                    waits.append(self._tokens[0][0] + self.period - now)
+                if not waits:
+                    self._requests.append(now)
+                    return
+            time.sleep(max(waits))
+
+    def record(self, token_count: int):
+        """Count tokens consumed by a completed request against the window."""
+        with self._lock:
+            self._tokens.append((time.monotonic(), token_count))
+            self._token_total += token_count
+
+gemini_limiter = RateLimiter(GEMINI_RPM, GEMINI_TPM)
+
+# Request Coalescing
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def single_flight(key: str, fn, *args, **kwargs):
+    """Run fn once per key at a time; concurrent callers with the same key share its result."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn(*args, **kwargs)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+# Semantic Cache
+class SemanticCache:
+    """Embedding-similarity cache that matches paraphrased prompts within a namespace.
+
+    Requires the optional ``sentence-transformers`` and ``faiss-cpu`` packages.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.90, model_name: str = 'all-MiniLM-L6-v2', k: int = 5,
+                 ttl: int = 3600, max_entries: int = 1000):
+        import faiss
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self._np = np
+        self.threshold = threshold
+        self.k = k
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._encoder = SentenceTransformer(model_name)
+        self._dim = self._encoder.get_sentence_embedding_dimension()
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache ("
+            "namespace TEXT, embedding BLOB, response TEXT, created_at REAL)"
+        )
+        self._prune()
+        self._conn.commit()
+
+    def _prune(self):
+        # Drop expired rows and the oldest rows beyond max_entries, then rebuild indexes lazily
+        deleted = self._conn.execute(
+            "DELETE FROM semantic_cache WHERE created_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+        deleted += self._conn.execute(
+            "DELETE FROM semantic_cache WHERE rowid NOT IN ("
+            "SELECT rowid FROM semantic_cache ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        ).rowcount
+        if deleted:
+            self._indexes.clear()
+
+    def embed(self, text: str):
+        """Return a normalized embedding so inner product equals cosine similarity."""
+        return self._encoder.encode([text], normalize_embeddings=True).astype('float32')
+
+    def _index(self, namespace: str):
+        # Lazily rebuild a namespace's FAISS index from persisted pairs
+        if namespace not in self._indexes:
+            index = self._faiss.IndexFlatIP(self._dim)
+            entries = []
+            rows = self._conn.execute(
+                "SELECT embedding, response, created_at FROM semantic_cache WHERE namespace = ? ORDER BY created_at",
+                (namespace,)
+            ).fetchall()
+            if rows:
+                vectors = self._np.stack([self._np.frombuffer(row[0], dtype='float32') for row in rows])
+                index.add(vectors)
+                entries = [(row[1], row[2]) for row in rows]
+            self._indexes[namespace] = (index, entries)
+        return self._indexes[namespace]
+
+    def search(self, embedding, namespace: str):
+        now = time.time()
+        with self._lock:
+            index, entries = self._index(namespace)
+            if index.ntotal == 0:
+                return None
+            scores, ids = index.search(embedding, min(self.k, index.ntotal))
+            for score, i in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                response, created_at = entries[i]
+                if now - created_at <= self.ttl:
+                    return response
+            return None
+
+    def add(self, embedding, namespace: str, response: str):
+        now = time.time()
+        with self._lock:
+            index, entries = self._index(namespace)
+            index.add(embedding)
+            entries.append((response, now))
+            self._conn.execute(
+                "INSERT INTO semantic_cache (namespace, embedding, response, created_at) VALUES (?, ?, ?, ?)",
+                (namespace, embedding[0].tobytes(), response, now)
+            )
+            self._prune()
+            self._conn.commit()
+
+PROMPT_URL_RE = re.compile(r'https?://\S+')
+
+def strip_urls(user_prompt: str) -> str:
+    """Remove URLs before embedding; the namespace already distinguishes them."""
+    return PROMPT_URL_RE.sub(' ', user_prompt)
+
+def semantic_namespace(user_prompt: str, system_prompt: str = None) -> str:
+    """Namespace on system prompt and any URLs so different PDFs never share answers."""
+    return cache_key(
+        system_prompt=system_prompt,
+        urls=sorted(PROMPT_URL_RE.findall(user_prompt)),
+        model_name=MODEL_NAME
+    )
+
+semantic_cache = None
+if SEMANTIC_CACHE_ENABLED:
+    try:
+        semantic_cache = SemanticCache(
+            CACHE_PATH,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            model_name=SEMANTIC_CACHE_MODEL,
+            ttl=CACHE_TTL,
+            max_entries=CACHE_MAX_ENTRIES
+        )
+    except Exception as e:
+        # Missing packages or a model that cannot be downloaded must not break every request
+        log.warning("Semantic cache disabled: %s", e)
+
+# PDF Parsing Function
+# One cloudscraper session per domain, most recently used last, each paired with a lock
+_scrapers = collections.OrderedDict()
+_scrapers_lock = threading.Lock()
+
+def _create_scraper(domain: str, clearance: dict = None):
+    """Create a cloudscraper session, restoring a stored clearance for the domain if given."""
+    import cloudscraper
+    if clearance:
+        # create_scraper() picks a random browser profile; matching the stored User-Agent
+        # restores the header set and cipher suite that earned the cookie
+        scraper = cloudscraper.create_scraper(browser={'custom': clearance["user_agent"]})
+        for name, value in clearance["cookies"].items():
+            scraper.cookies.set(name, value, domain=domain)
+    else:
+        scraper = cloudscraper.create_scraper()
+    # Resize the existing pools rather than mounting a plain HTTPAdapter,
+    # which would drop cloudscraper's TLS cipher configuration
+    for adapter in scraper.adapters.values():
+        adapter.init_poolmanager(SCRAPER_POOL_SIZE, SCRAPER_POOL_SIZE)
+    return scraper
+
+def _get_scraper(domain: str, refresh: bool = False):
+    """Return the domain's cloudscraper session and the lock guarding its requests.
+
+    cloudscraper counts challenge-solving loops per session, so concurrent requests
+    through one session can trip its loop protection; callers hold the lock around get().
+    """
+    if not refresh:
+        with _scrapers_lock:
+            entry = _scrapers.get(domain)
+            if entry is not None:
+                _scrapers.move_to_end(domain)
+                return entry
+
+    # Build outside the global lock since the clearance lookup may hit the store.
+    # A refresh means the stored clearance was just rejected, so start from scratch.
+    clearance = None if refresh else _load_clearance(domain)
+    entry = (_create_scraper(domain, clearance), threading.Lock())
+    with _scrapers_lock:
+        if refresh:
+            _scrapers[domain] = entry
+        else:
+            # Another thread may have created this domain's session in the meantime
+            entry = _scrapers.setdefault(domain, entry)
+        _scrapers.move_to_end(domain)
+        while len(_scrapers) > SCRAPER_CACHE_SIZE:
+            _scrapers.popitem(last=False)
+        return entry
+
+def _is_cloudflare_challenge(response) -> bool:
+    """Whether a 403/503 is a Cloudflare challenge rather than an error from the origin."""
+    if response.status_code not in CHALLENGE_STATUSES:
+        return False
+    if not response.headers.get('Server', '').lower().startswith('cloudflare'):
+        return False
+    if response.headers.get('cf-mitigated') == 'challenge':
+        return True
+    # Older interstitials only identify themselves in the body, which is small for an error page
+    return '/cdn-cgi/challenge-platform/' in response.text or 'jschl' in response.text
+
+def _domain_cookies(scraper, domain: str) -> dict:
+    return {
+        cookie.name: cookie.value for cookie in scraper.cookies
+        if domain.endswith(cookie.domain.lstrip('.'))
+    }
+
+def _load_clearance(domain: str):
+    """Return the stored cf_clearance cookies and User-Agent for the domain, if any."""
+    try:
+        clearance = clearance_cache.get(domain)
+    except Exception as e:
+        # A store outage only costs a challenge solve, never the request
+        log.warning("Clearance lookup failed for %s: %s", domain, e)
+        return None
+    return json.loads(clearance) if clearance is not None else None
+
+def _store_clearance(scraper, domain: str):
+    """Persist the domain's cf_clearance cookie and matching User-Agent."""
+    cookies = _domain_cookies(scraper, domain)
+    if 'cf_clearance' not in cookies:
+        return
+    try:
+        clearance_cache.set(domain, json.dumps({
+            "cookies": cookies,
+            "user_agent": scraper.headers.get('User-Agent')
+        }))
+    except Exception as e:
+        log.warning("Clearance store failed for %s: %s", domain, e)
+
+def _open_pdf_response(pdf_url: str):
+    """Start a streaming download, skipping the Cloudflare challenge when clearance is stored."""
+    domain = urlparse(pdf_url).hostname or ""
+    scraper, lock = _get_scraper(domain)
+    with lock:
+        response = scraper.get(pdf_url, stream=True, timeout=30)
+    if _is_cloudflare_challenge(response):
+        # Cloudflare clearance may have expired; retry once with a fresh session for this domain
+        response.close()
+        scraper, lock = _get_scraper(domain, refresh=True)
+        with lock:
+            response = scraper.get(pdf_url, stream=True, timeout=30)
+    if response.ok:
+        _store_clearance(scraper, domain)
+    return response
+
+def _extract_text(pdf_path: str) -> str:
+    """Extract text from all pages of the PDF at pdf_path."""
+    import fitz
+    # Plain-text extraction for LLM input: skip whitespace-preservation work
+    flags = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_WHITESPACE
+    pdf_doc = fitz.open(pdf_path, filetype="pdf")
+    try:
+        return "".join(page.get_text("text", flags=flags) for page in pdf_doc)
+    finally:
+        pdf_doc.close()
+
+def _url_hash(pdf_url: str) -> str:
+    return hashlib.sha256(pdf_url.encode()).hexdigest()
+
+def _fetch_pdf_text(pdf_url: str) -> str:
+    """Download a PDF and extract its text, reusing the persistent cache by URL hash."""
+    url_hash = _url_hash(pdf_url)
+    cached = pdf_cache.get(url_hash)
+    if cached is not None:
+        log.info("PDF cache hit: %s", pdf_url)
+        return cached
+
+    def download_and_cache():
+        text = _download_pdf_text(pdf_url)
+        pdf_cache.set(url_hash, text)
+        return text
+
+    # Concurrent calls for the same URL share a single download
+    return single_flight(f"pdf:{url_hash}", download_and_cache)
+
+def _download_pdf_text(pdf_url: str) -> str:
+    """Download a PDF and extract its text."""
+    response = _open_pdf_response(pdf_url)
+
+    # Stream the body to disk so large PDFs are never held in memory whole
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        with response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=PDF_CHUNK_SIZE):
+                pdf_file.write(chunk)
+        pdf_file.flush()
+        return _extract_text(pdf_file.name)
+
+def parse_pdf_from_url(pdf_url: str, write_images: bool = False) -> dict:
+    try:
+        text = _fetch_pdf_text(pdf_url)
+
+        if len(text) <= INLINE_TEXT_LIMIT:
+            return {
+                "status": "success",
+                "text_content": text,
+                "message": "Success"
+            }
+
+        # Large documents are returned by reference so the full text never enters the chat
+        text_id = _url_hash(pdf_url)
+        _remember_document(text_id, text)
+        return {
+            "status": "success",
+            "text_id": text_id,
+            "preview": text[:PREVIEW_CHARS],
+            "num_chars": len(text),
+            "message": f"Document too large to return inline; use fetch_pdf_chunk to read up to {MAX_CHUNK_CHARS} characters at a time"
+        }
+        
+    except Exception as e:
+        return {
+            "status": "error1",
+            "text_content": "",
+            "message": str(e)
+        }
+
+# Parsed documents handed to the model by reference, most recently used last
+_documents = collections.OrderedDict()
+_documents_lock = threading.Lock()
+
+def _remember_document(text_id: str, text: str):
+    with _documents_lock:
+        _documents[text_id] = text
+        _documents.move_to_end(text_id)
+        while len(_documents) > DOCUMENT_STORE_SIZE:
+            _documents.popitem(last=False)
+
+def fetch_pdf_chunk(text_id: str, start: int = 0, end: int = None) -> dict:
+    """Return a character range of a document previously parsed by parse_pdf_from_url."""
+    with _documents_lock:
+        text = _documents.get(text_id)
+    if text is None:
+        text = pdf_cache.get(text_id)
+        if text is None:
+            return {
+                "status": "error",
+                "text_content": "",
+                "message": "Unknown text_id; call parse_pdf_from_url again"
+            }
+        _remember_document(text_id, text)
+
+    # Function-call arguments arrive as floats
+    start = max(0, int(start))
+    end = len(text) if end is None else int(end)
+    end = min(end, start + MAX_CHUNK_CHARS, len(text))
+    return {
+        "status": "success",
+        "text_content": text[start:end],
+        "start": start,
+        "end": end,
+        "num_chars": len(text),
+        "message": "Success"
+    }
+
+# Tool function mapping
+tool_functions = {
+    "parse_pdf_from_url": parse_pdf_from_url,
+    "fetch_pdf_chunk": fetch_pdf_chunk
+}
+
+# Define PDF parsing tools
+@functools.lru_cache(maxsize=None)
+def get_pdf_tool():
+    """Build the PDF parsing tool declarations once per process."""
+    from google.generativeai import types
+
+    return types.Tool(
+        function_declarations=[
+            types.FunctionDeclaration(
+                name="parse_pdf_from_url",
+                description="Downloads a PDF from a URL and converts it to plain text format. Use this when the user provides a PDF link. Large documents return a text_id and preview instead of the full text.",
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "pdf_url": {
+                            "type": "string",
+                            "description": "The complete URL of the PDF file to download and parse"
+                        },
+                        "write_images": {
+                            "type": "boolean",
+                            "description": "Whether to extract and save images from the PDF (default: false)"
+                        }
+                    },
+                    "required": ["pdf_url"]
+                }
+            ),
+            types.FunctionDeclaration(
+                name="fetch_pdf_chunk",
+                description="Reads a character range of a large PDF previously parsed by parse_pdf_from_url, identified by its text_id.",
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "text_id": {
+                            "type": "string",
+                            "description": "The text_id returned by parse_pdf_from_url"
+                        },
+                        "start": {
+                            "type": "integer",
+                            "description": "Character offset to start reading from"
+                        },
+                        "end": {
+                            "type": "integer",
+                            "description": f"Character offset to stop reading at (at most {MAX_CHUNK_CHARS} characters per call)"
+                        }
+                    },
+                    "required": ["text_id", "start"]
+                }
+            )
+        ]
+    )
+
+@functools.lru_cache(maxsize=16)
+def get_model(system_prompt: str = None):
+    """Return a GenerativeModel for the system prompt, built once per prompt."""
+    return _get_genai().GenerativeModel(
+        model_name=MODEL_NAME,
+        tools=[get_pdf_tool()],
+        system_instruction=system_prompt if system_prompt else "You are a helpful assistant.",
+        # Set on the model so the cap also applies to turns answering tool calls
+        generation_config={
+            "temperature": 0.1,
+            "max_output_tokens": MAX_OUTPUT_TOKENS,
+            "candidate_count": 1
+        }
+    )
+
+def _send_message(chat, content):
+    """Send a chat message once the Gemini rate limits allow it."""
+    gemini_limiter.acquire()
+    response = chat.send_message(content)
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        gemini_limiter.record(usage.total_token_count)
+    return response
+
+def _call_tools(function_calls) -> list:
+    """Execute the model's tool calls, running independent downloads concurrently."""
+    def call(function_call):
+        if function_call.name not in tool_functions:
+            return {"status": "error", "message": f"Unknown function: {function_call.name}"}
+        try:
+            return tool_functions[function_call.name](**dict(function_call.args))
+        except Exception as e:
+            # Bad arguments from the model are reported back so it can retry
+            log.warning("Tool %s failed: %s", function_call.name, e)
+            return {"status": "error", "message": f"{type(e).__name__}: {e}"}
+
+    if len(function_calls) == 1:
+        return [call(function_calls[0])]
+    with ThreadPoolExecutor(max_workers=min(len(function_calls), MAX_TOOL_WORKERS)) as executor:
+        return list(executor.map(call, function_calls))
+
+def run_pdf_agent(user_prompt: str, system_prompt: str = None, max_iterations: int = 10):
+    """Run Gemini agent with PDF parsing capability, serving repeats from cache.
+
+    Prefix the prompt with ``!skip`` to bypass the cache for this request.
+    """
+    skip_cache = user_prompt.startswith(SKIP_CACHE_COMMAND)
+    if skip_cache:
+        user_prompt = user_prompt[len(SKIP_CACHE_COMMAND):].lstrip()
+
+    key = cache_key(
+        user_prompt=user_prompt,
+        system_prompt=system_prompt,
+        max_iterations=max_iterations,
+        model_name=MODEL_NAME
+    )
+    namespace = semantic_namespace(user_prompt, system_prompt) if semantic_cache else None
+    embedding = None
+    if not skip_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            log.info("Response cache hit")
+            return cached
+
+        if semantic_cache:
+            embedding = semantic_cache.embed(strip_urls(user_prompt))
+            cached = semantic_cache.search(embedding, namespace)
+            if cached is not None:
+                log.info("Semantic cache hit")
+                return cached
+
+    def run_and_cache():
+        result, cacheable = _run_agent(user_prompt, system_prompt, max_iterations)
+        if cacheable:
+            response_cache.set(key, result)
+            if semantic_cache:
+                vector = embedding if embedding is not None else semantic_cache.embed(strip_urls(user_prompt))
+                semantic_cache.add(vector, namespace, result)
+        return result
+
+    # Identical concurrent requests wait for the first one instead of calling Gemini again
+    return single_flight(f"agent:{key}", run_and_cache)
+
+def _run_agent(user_prompt: str, system_prompt: str = None, max_iterations: int = 10):
+    """Run the Gemini chat loop, executing tool calls until a text answer arrives.
+
+    Returns ``(text, cacheable)``; answers built on a failed tool call or cut off
+    by the output token cap are not cacheable.
+    """
+    try:
+        genai = _get_genai()
+        chat = get_model(system_prompt).start_chat()
+        
+        # The user prompt is sent once; later turns only carry tool results
+        response = _send_message(chat, user_prompt)
+        tool_rounds = 0
+        tools_failed = False
+        
+        while True:
+            function_calls = [
+                part.function_call for part in response.candidates[0].content.parts
+                if part.function_call
+            ]
+            if not function_calls:
+                candidate = response.candidates[0]
+                if candidate.finish_reason == genai.protos.Candidate.FinishReason.MAX_TOKENS:
+                    # response.text raises when thinking used the whole budget and no text was produced
+                    log.warning("Answer truncated at max_output_tokens=%d", MAX_OUTPUT_TOKENS)
+                    return "".join(part.text for part in candidate.content.parts), False
+                return response.text, not tools_failed
+            if tool_rounds >= max_iterations:
+                return MAX_ITERATIONS_MESSAGE, False
+            
+            tool_rounds += 1
+            log.debug("Tool round %d", tool_rounds)
+            
+            for function_call in function_calls:
+                log.info("Calling function: %s", function_call.name)
+                log.debug("Arguments: %s", dict(function_call.args))
+            
+            # Run every call from this turn together and answer them in a single message
+            results = _call_tools(function_calls)
+            for result in results:
+                log.debug("Function result status: %s", result.get('status'))
+                if result.get('status') != 'success':
+                    tools_failed = True
+            
+            response = _send_message(
+                chat,
+                genai.protos.Content(
+                    parts=[
+                        genai.protos.Part(
+                            function_response=genai.protos.FunctionResponse(
+                                name=function_call.name,
+                                response={'result': result}
+                            )
+                        )
+                        for function_call, result in zip(function_calls, results)
+                    ]
+                )
+            )
+        
+    except Exception as e:
+        log.exception("Error in run_pdf_agent: %s", e)
+        raise
+
+# Subject and content sections are found in a single scan
+SECTIONS_RE = re.compile(
+    r'Subject:\s*(?P<subject>.+?)(?=\n\nContent:)|Content:\s*(?P<content>.+)',
+    re.DOTALL
+)
+URL_RE = re.compile(r'https://[^\s]+')
+TIME_FMT = '%Y-%m-%d %H:%M:%S'
+
+def parse_response(text: str):
+    """Parse the agent response to extract subject, content, and URL.
+
+    Sections are read in a single left-to-right scan, so unlike separate searches:
+    a Subject: after the first Content: section is ignored, and a subject that itself
+    contains "Content:" no longer starts the content there, e.g. "Subject: Content: foo\\n\\nContent: bar"
+    gives content "bar" rather than "foo\\n\\nContent: bar".
+    """
+    subject = ""
+    content = text
+    # A subject match ends right at "\n\nContent:", so at most one precedes the content
+    for match in SECTIONS_RE.finditer(text):
+        if match.lastgroup == 'subject':
+            subject = match.group('subject').strip()
+        else:
+            # Content runs to the end of the text, so nothing can follow it
+            content = match.group('content').strip()
+            break
+
+    url_match = URL_RE.search(text)
+    url = url_match.group(0) if url_match else ""
+
+    return {
+        "time": f"Updated on: {time.strftime(TIME_FMT)}",
+        "subject": subject,
+        "content": content,
+        "url": url
+    }